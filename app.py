@@ -1,110 +1,280 @@
 import streamlit as st
 import requests
+import orjson
 import pandas as pd
+import numpy as np
 from io import BytesIO, StringIO 
 import re
-import time
+import csv
+import gzip
+import math
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 # --- 定数設定 ---
 # APIのエンドポイント
 API_URL = "https://www.showroom-live.com/api/event/room_list"
 # オーガナイザーリストのURL
 ORGANIZER_LIST_URL = "https://mksoul-pro.com/showroom/file/organizer_list.csv"
+# オーガナイザーリストのキャッシュ有効期間（秒）
+ORGANIZER_LIST_TTL = 3600
+# ダウンロード用CSVバイトデータのキャッシュ有効期間（秒）と最大保持件数
+DOWNLOAD_CACHE_TTL = 600
+DOWNLOAD_CACHE_MAX_ENTRIES = 4
+# ページ並列取得時の最大ワーカー数
+MAX_WORKERS = 8
+# イベント並列取得時の最大ワーカー数
+MAX_EVENT_WORKERS = 4
+# 共有HTTPセッションのコネクションプールサイズ（イベント数×ページ数の並列度に合わせる）
+HTTP_POOL_SIZE = MAX_WORKERS * MAX_EVENT_WORKERS
+# レート制限・サーバーエラー時のリトライ設定（最大リトライ回数、バックオフ係数・待機時間の上限（秒）、対象のHTTPステータス）
+MAX_RETRIES = 3
+RETRY_BACKOFF = 0.3
+RETRY_BACKOFF_MAX = 8
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+# イベントID入力の解析用（再実行のたびにコンパイルしないよう、モジュールで一度だけ生成）
+_DIGITS_RE = re.compile(r'\d+')
+
+# --- クラス: 待機時間に上限を設けたリトライ設定 ---
+class _CappedRetry(Retry):
+    """
+    再試行までの待機時間を RETRY_BACKOFF_MAX 秒までに制限したRetryです。
+    Retry-Afterヘッダーに長い時間が指定されても、取得処理（画面）が長時間止まらないようにします。
+    """
+    def get_backoff_time(self):
+        return min(super().get_backoff_time(), RETRY_BACKOFF_MAX)
+
+    def get_retry_after(self, response):
+        retry_after = super().get_retry_after(response)
+        if retry_after is None:
+            return None
+        return min(retry_after, RETRY_BACKOFF_MAX)
+
+# --- 関数: 共有HTTPセッションを取得 ---
+@st.cache_resource
+def _http_session():
+    """
+    全てのAPI呼び出しで共有するHTTPセッションを作成して返します。
+    接続（TCP/TLS）をイベント・ページ・セッションをまたいで使い回し、
+    サーバーから制限やエラー（HTTP 429/5xx）を受けた場合のみ、
+    Retry-Afterヘッダー（無ければ指数バックオフ）に従って、最大 RETRY_BACKOFF_MAX 秒待機して再試行します。
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=HTTP_POOL_SIZE,
+        pool_maxsize=HTTP_POOL_SIZE,
+        max_retries=_CappedRetry(
+            total=MAX_RETRIES,
+            backoff_factor=RETRY_BACKOFF,
+            status_forcelist=RETRY_STATUS_CODES,
+        ),
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update({"User-Agent": "sr-event-liver/1.0"})
+    return session
+
+# --- 関数: APIから1ページ分のデータを取得 ---
+def _fetch_page(session, event_id, page):
+    """
+    指定されたイベントIDの1ページ分のデータを取得し、
+    (APIのルームリスト, 次ページ番号, 最終ページ番号, 総件数) を返します。
+    ワーカースレッドから呼ばれるため、Streamlitの描画は行いません。
+    """
+    # API URLを構築
+    url = f"{API_URL}?event_id={event_id}&p={page}"
+
+    # APIコール（レート制限時の再試行はセッションのアダプターが行う）
+    response = session.get(url, timeout=10)
+    response.raise_for_status() # HTTPエラーが発生した場合に例外を発生させる
+    data = orjson.loads(response.content) # 標準のjsonより高速にパース
+
+    return (
+        data.get("list", []),
+        data.get("next_page"),
+        data.get("last_page"),
+        data.get("total_entries"),
+    )
+
+# --- 関数: ルームリストをDataFrameに変換 ---
+def _rooms_to_frame(room_lists):
+    """
+    APIのルームリスト（ページ単位）から必要な情報を抽出し、
+    room_id, event_id, room_name, organizer_id の列を持つDataFrameを返します。
+    """
+    # 列ごとのリストに蓄積し、最後に一度だけDataFrameを構築する
+    room_ids, event_ids, room_names, organizer_ids = [], [], [], []
+
+    # データを処理して、必要な情報を抽出 (room_id, event_id, organizer_id, room_name)
+    for room_list in room_lists:
+        # ページ単位で1行ずつタプルとして抽出する（行ごとに4つのリストへ追加するより軽量）
+        rows = [
+            (
+                room_data.get("room_id"),
+                (room_data.get("event_entry") or {}).get("event_id"), # event_entryネスト内のevent_id（nullの場合も考慮）
+                room_data.get("room_name", ""), # ルーム名
+                room_data.get("organizer_id", 0), # オーガナイザーID
+            )
+            for room_data in room_list
+        ]
+        # room_idとevent_idの両方があるものだけを対象とする
+        rows = [row for row in rows if row[0] and row[1]]
+        if not rows:
+            continue
+
+        # 列ごとに転置し、全て文字列に統一してまとめて追加
+        page_room_ids, page_event_ids, page_room_names, page_organizer_ids = zip(*rows)
+        room_ids.extend(map(str, page_room_ids))
+        event_ids.extend(map(str, page_event_ids))
+        room_names.extend(map(str, page_room_names))
+        organizer_ids.extend(map(str, page_organizer_ids))
+
+    return pd.DataFrame({
+        "room_id": room_ids,
+        "event_id": event_ids,
+        "room_name": room_names,
+        "organizer_id": organizer_ids,
+    }, dtype="string")
+
+# --- クラス: ルーム情報取得の失敗 ---
+class RoomFetchError(Exception):
+    """
+    ルーム情報の取得が途中で失敗したことを表す例外です。
+    失敗した結果がキャッシュされないよう、fetch_all_room_data から送出され、
+    それまでに取得できたDataFrame（frame）と進捗メッセージ（messages）を保持します。
+    """
+    def __init__(self, frame, messages):
+        super().__init__(messages[-1][1])
+        self.frame = frame
+        self.messages = messages
 
 # --- 関数: APIから全ページデータを取得 ---
-@st.cache_data(show_spinner="イベント参加ルーム情報を取得中...")
-def fetch_all_room_data(event_id):
+@st.cache_data(show_spinner=False)
+def fetch_all_room_data(event_id, _session):
     """
     指定されたイベントIDの全ページからルーム情報を取得し、
-    ルームID、イベントID、ルーム名、オーガナイザーIDのリストを返します。
+    (ルームID、イベントID、ルーム名、オーガナイザーIDのDataFrame, 進捗メッセージのリスト) を返します。
+    1ページ目で総ページ数を判定し、2ページ目以降は並列に取得します。
+    複数イベントを並列に取得する際に表示が入り混じらないよう、ここでは描画せず、
+    進捗メッセージは (表示種別, メッセージ) のリストとして返し、呼び出し側で表示します。
+    途中で失敗した場合は、その結果をキャッシュしないよう RoomFetchError を送出します。
+    _session は共有HTTPセッションで、キャッシュのキーには含まれません。
     """
-    st.write(f"イベントID: **{event_id}** の情報を取得します。")
-    all_rooms = []
+    messages = [("write", f"イベントID: **{event_id}** の情報を取得します。")]
+    pages = {} # ページ番号 -> APIのルームリスト
     page = 1
-    
-    # ページング処理を無限ループで行い、データがなくなるまで続ける
-    while True:
+
+    try:
+        # 1ページ目を取得し、総ページ数を判定する
+        room_list, next_page, api_last_page, total_entries = _fetch_page(_session, event_id, page)
+        if not room_list:
+            messages.append(("info", f"ページ {page}: ルームが見つかりませんでした。"))
+            return _rooms_to_frame([]), messages
+        pages[page] = room_list
+        messages.append(("text", f"ページ {page} 処理完了。次ページ: {next_page}"))
+
+        # 1ページ目のメタデータから総ページ数が分かる場合は、必要なページだけを取得する
+        # (末尾の空ページを確認するための余分なリクエストは発生しない)
+        if next_page is None or next_page == page:
+            # 1ページのみ
+            last_page = page
+        elif api_last_page:
+            # 最終ページ番号が返される場合はそのまま使用
+            last_page = int(api_last_page)
+        elif total_entries:
+            # 総件数が分かる場合は、1ページ目の件数（1ページあたりの件数）から総ページ数を算出
+            per_page = len(room_list)
+            last_page = math.ceil(int(total_entries) / per_page)
+        else:
+            # 総ページ数が分からない場合は 2, 4, 8, ... と倍々にページを探索して空ページを見つけ、
+            # その後、データのある最後のページ(lo)と空ページ(hi)の間を二分探索して最終ページを特定する
+            lo, hi = page, None
+            while hi is None or hi - lo > 1:
+                page = lo * 2 if hi is None else (lo + hi) // 2
+                room_list, next_page, _, _ = _fetch_page(_session, event_id, page)
+                if not room_list:
+                    hi = page
+                    continue
+                pages[page] = room_list
+                messages.append(("text", f"ページ {page} 処理完了。次ページ: {next_page}"))
+                lo = page
+                if next_page is None or next_page == page:
+                    # 最終ページが見つかった
+                    hi = page + 1
+            last_page = lo
+
+        # 残りのページを並列に取得（同時接続数はワーカー数で制限）
+        remaining_pages = [p for p in range(2, last_page + 1) if p not in pages]
+        executor = ThreadPoolExecutor(max_workers=MAX_WORKERS)
         try:
-            # API URLを構築
-            url = f"{API_URL}?event_id={event_id}&p={page}"
-            
-            # APIコール
-            response = requests.get(url, timeout=10)
-            response.raise_for_status() # HTTPエラーが発生した場合に例外を発生させる
-            data = response.json()
-
-            # ルームリストを抽出
-            room_list = data.get("list", [])
-            
-            if not room_list:
-                # リストが空であれば、最終ページに到達したと判断してループを終了
-                st.info(f"ページ {page}: ルームが見つかりませんでした。全 {page-1} ページを処理しました。")
-                break
-
-            # データを処理して、必要な情報を抽出 (room_id, event_id, organizer_id, room_name)
-            for room_data in room_list:
-                room_id = room_data.get("room_id")
-                room_name = room_data.get("room_name", "") # ルーム名
-                organizer_id = room_data.get("organizer_id", 0) # オーガナイザーID
-                
-                # event_entryネスト内のevent_idを取得
-                entry_data = room_data.get("event_entry", {})
-                current_event_id = entry_data.get("event_id")
-
-                if room_id and current_event_id:
-                    # 全て文字列に統一
-                    all_rooms.append({
-                        "room_id": str(room_id),
-                        "event_id": str(current_event_id),
-                        "room_name": str(room_name),
-                        "organizer_id": str(organizer_id),
-                    })
-            
-            # APIのレスポンスから次のページ番号を取得
-            next_page = data.get("next_page")
-            st.text(f"ページ {page} 処理完了。次ページ: {next_page}")
-
-            if next_page is None or next_page == page:
-                # next_pageが存在しないか、現在のページと同じ場合はループ終了
-                break
-
-            page = next_page
-            # サーバー負荷軽減のため、ページ間に短い待機時間を設ける
-            time.sleep(0.5)
-
-        except requests.exceptions.RequestException as e:
-            st.error(f"APIリクエストエラー (ページ {page}): {e}")
-            break
-        except Exception as e:
-            st.error(f"予期せぬエラーが発生しました (ページ {page}): {e}")
-            break
-
-    return all_rooms
+            futures = [
+                (p, executor.submit(_fetch_page, _session, event_id, p))
+                for p in remaining_pages
+            ]
+            # ページ順に結果を受け取る
+            for page, future in futures:
+                room_list, next_page, _, _ = future.result()
+                if room_list:
+                    pages[page] = room_list
+                messages.append(("text", f"ページ {page} 処理完了。次ページ: {next_page}"))
+        finally:
+            # いずれかのページで失敗した場合は、残りのページを取得し続けないよう未実行のリクエストを取り消す
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    except Exception as e:
+        if isinstance(e, requests.exceptions.RequestException):
+            messages.append(("error", f"APIリクエストエラー (ページ {page}): {e}"))
+        else:
+            messages.append(("error", f"予期せぬエラーが発生しました (ページ {page}): {e}"))
+        messages.append(("info", f"取得できた {len(pages)} ページ分のみを使用します。"))
+        # 途中までの結果はキャッシュせず、呼び出し側に渡す（次回の実行時に再取得される）
+        raise RoomFetchError(_rooms_to_frame(pages[p] for p in sorted(pages)), messages) from e
+
+    messages.append(("info", f"全 {len(pages)} ページを処理しました。"))
+
+    # ページ順に結合して返す
+    return _rooms_to_frame(pages[p] for p in sorted(pages)), messages
+
+# --- 関数: イベントのルーム情報を取得（失敗時も含む） ---
+def _fetch_event_rooms(event_id, session):
+    """
+    fetch_all_room_data を呼び出し、(DataFrame, 進捗メッセージのリスト) を返します。
+    取得が途中で失敗した場合も、それまでに取得できた結果とエラーメッセージを返します
+    （失敗した結果はキャッシュされません）。
+    """
+    try:
+        return fetch_all_room_data(event_id, session)
+    except RoomFetchError as e:
+        return e.frame, e.messages
 
 # --- 関数: オーガナイザーリストを取得し、ID-Nameの辞書を作成 ---
-@st.cache_data(show_spinner="オーガナイザーリストを取得中...")
-def fetch_organizer_list(url):
+@st.cache_data(ttl=ORGANIZER_LIST_TTL, max_entries=4, show_spinner="オーガナイザーリストを取得中...")
+def fetch_organizer_list(url, _session):
     """
     指定されたURLからCSVファイルをダウンロードし、オーガナイザーIDをキー、
     オーガナイザー名を値とする辞書を返します。
+    _session は共有HTTPセッションで、キャッシュのキーには含まれません。
     """
     st.info(f"オーガナイザーリストを **{url}** から取得します。")
     try:
-        response = requests.get(url, timeout=10)
+        response = _session.get(url, timeout=10)
         response.raise_for_status()
         
         # CSVデータをStringIOで読み込む
         # CSVは通常、UTF-8で提供されると仮定
-        csv_data = StringIO(response.content.decode('utf-8'))
+        # 2列の対応表を作るだけなので、DataFrameを経由せず標準のcsvモジュールで直接辞書にする
+        reader = csv.reader(StringIO(response.content.decode('utf-8')))
         
-        # 1行目をヘッダーとして読み込み、2列を文字列として取得
-        df = pd.read_csv(csv_data, header=0, dtype=str)
+        # 1行目はヘッダー
+        header = next(reader, None)
         
         # 辞書を作成 {オーガナイザーID: オーガナイザー名}
         # 列名が日本語なので、存在チェック
-        if len(df.columns) >= 2:
+        if header is not None and len(header) >= 2:
             # 1列目がID、2列目が名前として使用
-            organizer_map = pd.Series(df.iloc[:, 1].values, index=df.iloc[:, 0]).to_dict()
+            organizer_map = {row[0]: row[1] for row in reader if len(row) >= 2}
             st.success(f"オーガナイザーリストを正常に取得しました。**{len(organizer_map)}** 件")
             return organizer_map
         else:
@@ -118,13 +288,75 @@ def fetch_organizer_list(url):
         st.error(f"オーガナイザーリストの処理中に予期せぬエラーが発生しました: {e}")
         return {}
 
+# --- 関数: DataFrameをCP932のCSVバイトデータに変換 ---
+@st.cache_data(ttl=DOWNLOAD_CACHE_TTL, max_entries=DOWNLOAD_CACHE_MAX_ENTRIES, show_spinner=False)
+def _encode_csv_cp932(df):
+    """
+    DataFrameをヘッダーなしのCSVに変換し、CP932（Shift_JIS）のバイトデータを返します。
+    同じ結果に対しては再実行のたびにエンコードし直さないよう、キャッシュします
+    （メモリを圧迫しないよう、保持期間・件数は制限）。
+    """
+    # NOTE: Windows環境で文字化けしないよう、Shift_JIS (CP932) で出力する
+    # BOM付きUTF-8も選択肢だが、汎用的なShift_JIS系で対応
+    # UTF-8の文字列を経由せず、CP932で直接バイトデータに書き出す（変換できない文字は無視）
+    buffer = BytesIO()
+    df.to_csv(buffer, index=False, header=False, encoding='cp932', errors='ignore')
+    return buffer.getvalue()
+
+# --- 関数: DataFrameをgzip圧縮したCSVバイトデータに変換 ---
+@st.cache_data(ttl=DOWNLOAD_CACHE_TTL, max_entries=DOWNLOAD_CACHE_MAX_ENTRIES, show_spinner=False)
+def _encode_csv_gzip(df):
+    """
+    DataFrameをCP932のCSVに変換した上でgzip圧縮したバイトデータを返します。
+    """
+    return gzip.compress(_encode_csv_cp932(df), compresslevel=6)
+
+# --- 関数: 結果の表示・ダウンロード（フラグメント） ---
+@st.fragment
+def _results_fragment(event_ids):
+    """
+    セッションに保持した最終結果を表示し、CSVダウンロードボタンを表示します。
+    結果は、現在入力されているイベントID（event_ids）から取得したものである場合のみ表示します。
+    フラグメントとして実行されるため、ダウンロードボタンなどの操作では
+    スクリプト全体ではなくこの関数だけが再実行されます。
+    """
+    final_df = st.session_state.get('final_df')
+    # 入力が変更された場合、以前のイベントIDの結果は表示しない
+    if final_df is None or st.session_state.get('final_event_ids') != tuple(event_ids):
+        return
+
+    st.subheader("📊 最終的な結果データ（重複排除・ソート後）")
+    st.dataframe(final_df)
+    st.success(f"重複排除・ソート後、**{len(final_df)}** 件のユニークなルーム情報が確定しました。")
+    
+    # --- 5. CSVダウンロード機能 ---
+    st.download_button(
+        label="⬇️ 結果をCSVファイルとしてダウンロード",
+        data=_encode_csv_cp932(final_df), # CP932バイトデータを渡す
+        file_name='showroom_event_liver_info.csv', # ファイル名を更新
+        mime='text/csv',
+        key='download-csv'
+    )
+    # 件数が多い場合向けに、gzip圧縮したCSVも用意（転送量を削減）
+    st.download_button(
+        label="⬇️ 結果をgzip圧縮CSVファイルとしてダウンロード",
+        data=_encode_csv_gzip(final_df),
+        file_name='showroom_event_liver_info.csv.gz',
+        mime='application/gzip',
+        key='download-csv-gz'
+    )
+
 # --- メイン Streamlit アプリケーション ---
 def main():
     st.title("SHOWROOM イベント参加ルーム情報 抽出ツール")
     st.markdown("---")
 
     # --- 0. オーガナイザーリストの取得 ---
-    organizer_map = fetch_organizer_list(ORGANIZER_LIST_URL)
+    # リストはキャッシュされるため、更新直後に反映したい場合はキャッシュを破棄して再取得する
+    if st.button("🔄 オーガナイザーリストをリロード", key='reload-organizer-list'):
+        fetch_organizer_list.clear()
+    session = _http_session()
+    organizer_map = fetch_organizer_list(ORGANIZER_LIST_URL, session)
     
     # --- 1. イベントID入力 ---
     event_ids_input = st.text_area(
@@ -133,12 +365,9 @@ def main():
     )
     
     # 複数のイベントIDを解析
-    event_ids = []
-    if event_ids_input:
-        # 改行またはカンマで分割し、不要な空白を除去
-        raw_ids = re.split(r'[\n,]+', event_ids_input.strip())
-        # 空でない、数字のみの文字列を抽出
-        event_ids = [eid.strip() for eid in raw_ids if eid.strip().isdigit()]
+    # 数字の並びを一度の走査で抽出する（改行・カンマ・空白などの区切り文字は自然に除外される）
+    # 同じイベントIDを重複して取得しないよう、入力順を保ったまま重複を除去
+    event_ids = list(dict.fromkeys(_DIGITS_RE.findall(event_ids_input or "")))
 
     if not event_ids:
         st.warning("イベントIDを入力してください。")
@@ -151,25 +380,49 @@ def main():
     if st.button("🚀 実行: ルーム情報を取得"):
         
         # 全イベントのデータ取得
-        new_data_list = []
         with st.spinner("APIからデータを取得中..."):
-            for event_id in event_ids:
-                rooms = fetch_all_room_data(event_id)
-                new_data_list.extend(rooms)
+            # イベントごとの取得は互いに独立しているため並列に実行する
+            with ThreadPoolExecutor(max_workers=MAX_EVENT_WORKERS) as executor:
+                results = list(executor.map(
+                    lambda event_id: _fetch_event_rooms(event_id, session), event_ids
+                ))
+
+        # 進捗は入力されたイベントIDの順に、イベントごとにまとめて表示し、結果も同じ順に結合
+        frames = []
+        for frame, messages in results:
+            for level, message in messages:
+                getattr(st, level)(message)
+            frames.append(frame)
+        new_df = pd.concat(frames, ignore_index=True)
         
-        if not new_data_list:
+        if new_df.empty:
             st.error("入力された全てのイベントIDについて、ルーム情報を取得できませんでした。処理を中断します。")
+            # 前回の結果が残らないよう破棄する
+            st.session_state.pop('final_df', None)
+            st.session_state.pop('final_event_ids', None)
             return
-            
-        # 取得データをDataFrameに変換
-        new_df = pd.DataFrame(new_data_list, dtype=str)
+
+        # ID列は数値型、オーガナイザーIDはカテゴリ型に変換（比較・ソートを高速化し、メモリを削減）
+        # ID列は2列まとめて一度で数値化する（数値化できない値は欠損値とする）
+        new_df = new_df.astype({'room_name': 'string', 'organizer_id': 'category'})
+        new_df[['room_id', 'event_id']] = (
+            new_df[['room_id', 'event_id']].apply(pd.to_numeric, errors='coerce').astype('Int64')
+        )
         
         # --- 3. オーガナイザー名マッピング処理 ---
         st.subheader("🔗 オーガナイザー名のマッピング")
         if organizer_map:
             # organizer_idに基づいてorganizer_nameをマッピング
+            # 行ごとではなくカテゴリ（ユニークなorganizer_id）ごとに名前を引き、カテゴリコードで各行に展開する
             # マッチしない場合はNaNになるため、fillna('')でブランクに変換
-            new_df['organizer_name'] = new_df['organizer_id'].map(organizer_map).fillna('')
+            organizer_ids = new_df['organizer_id']
+            category_names = organizer_ids.cat.categories.map(organizer_map).fillna('').to_numpy(dtype=object)
+            # 末尾に''を追加し、カテゴリコード -1（欠損）の行もブランクになるようにする
+            category_names = np.append(category_names, '')
+            new_df['organizer_name'] = pd.Series(
+                category_names[organizer_ids.cat.codes.to_numpy()], index=new_df.index, dtype='string'
+            )
+            del organizer_ids, category_names
             st.success("オーガナイザー名のマッピングを完了しました。")
         else:
             new_df['organizer_name'] = ''
@@ -179,48 +432,35 @@ def main():
         st.markdown("---")
         st.header("🔄 重複排除・ソート")
 
-        final_df = new_df.copy()
-
-        # 1. event_idを数値に変換（比較のため）
-        final_df['event_id_num'] = pd.to_numeric(final_df['event_id'], errors='coerce')
-        
-        # 2. room_idでグルーピングし、event_id_numの最大値（新しいもの）を持つ行を選択
-        final_df = final_df.loc[
-            final_df.groupby('room_id')['event_id_num'].idxmax()
-        ]
-        
-        # 3. 作業用列を削除し、最終的な列の順番を設定
-        final_df = final_df.drop(columns=['event_id_num'])
-        
-        # 💡 修正箇所: room_idを数値に変換してからソートする
-        final_df['room_id_num'] = pd.to_numeric(final_df['room_id'], errors='coerce')
-        final_df = final_df.sort_values(by='room_id_num', ascending=True)
-        final_df = final_df.drop(columns=['room_id_num']) # 作業用列を削除
+        # 1. room_id・event_id（いずれも数値型）の順に並べ替え
+        # 2. room_idごとに最後の行、つまりevent_idの最大値（新しいもの）を持つ行を残す
+        #    (groupby + idxmax より軽量。event_idが欠損している行は優先度が最も低くなるよう先頭に置く)
+        # 並べ替えはキー列のみで行い、残す行のインデックス（room_idの昇順）だけを求める
+        # room_idが欠損している行は対象外
+        key_df = new_df[['room_id', 'event_id']].dropna(subset=['room_id'])
+        # int64配列に対してnumpyの安定ソート（lexsortは最後のキーが第1キー）で並び順を求める
+        # イベントIDは正の整数のため、欠損値は-1として先頭に置く
+        order = np.lexsort((
+            key_df['event_id'].to_numpy(dtype='int64', na_value=-1),
+            key_df['room_id'].to_numpy(dtype='int64'),
+        ))
+        keep_index = key_df.iloc[order].drop_duplicates('room_id', keep='last').index
 
         # 最終的な出力列の順番
         OUTPUT_COLUMNS = ['room_id', 'event_id', 'room_name', 'organizer_id', 'organizer_name']
-        final_df = final_df[OUTPUT_COLUMNS]
+        # 残す行・出力列だけを一度で取り出す（new_df全体のコピーは作らない）
+        final_df = new_df.loc[keep_index, OUTPUT_COLUMNS].reset_index(drop=True)
+
+        # 描画前に不要になった取得データ・作業用データへの参照を外し、解放する
+        # (参照が無くなった時点で即座に解放されるため、gc.collect() は不要)
+        del new_df, key_df, order, frames, results
+
+        # 結果は取得元のイベントIDと合わせてセッションに保持し、表示・ダウンロードは結果表示用のフラグメントで行う
+        st.session_state['final_df'] = final_df
+        st.session_state['final_event_ids'] = tuple(event_ids)
+
+    # --- 結果の表示 ---
+    _results_fragment(event_ids)
 
-        st.subheader("📊 最終的な結果データ（重複排除・ソート後）")
-        st.dataframe(final_df)
-        st.success(f"重複排除・ソート後、**{len(final_df)}** 件のユニークなルーム情報が確定しました。")
-        
-        # --- 5. CSVダウンロード機能 ---
-        # DataFrameをCSV文字列（UTF-8）に変換（ヘッダーなし）
-        # NOTE: Windows環境で文字化けしないよう、Shift_JIS (CP932) に変換する
-        csv_string_utf8 = final_df.to_csv(index=False, header=False, encoding='utf-8')
-        
-        # 文字列をCP932（Shift_JIS）バイトデータに変換
-        # BOM付きUTF-8も選択肢だが、汎用的なShift_JIS系で対応
-        csv_data_cp932 = csv_string_utf8.encode('cp932', 'ignore') 
-        
-        st.download_button(
-            label="⬇️ 結果をCSVファイルとしてダウンロード",
-            data=csv_data_cp932, # CP932バイトデータを渡す
-            file_name='showroom_event_liver_info.csv', # ファイル名を更新
-            mime='text/csv',
-            key='download-csv'
-        )
-        
 if __name__ == "__main__":
     main()
\ No newline at end of file